@@ -1,11 +1,12 @@
 import base64
+import bisect
 import collections
 import io
 import itertools
 import logging
 import math
 import os
-from functools import lru_cache
+from functools import lru_cache, partial
 from typing import TYPE_CHECKING
 
 import fsspec.core
@@ -38,6 +39,53 @@ def _first(d):
     return list(d.values())[0]
 
 
+def _load_json(f):
+    """Parse the JSON document in a binary file-like
+
+    If the C backend of ``ijson`` is available, the top-level mapping is built
+    incrementally from the stream, so that the complete text of a (possibly
+    decompressed) large reference file is never held in memory next to the
+    parsed result.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return json.load(f)
+    if ijson.backend != "yajl2_c":
+        # pure-python backends are much slower than json.load
+        return json.load(f)
+    return dict(ijson.kvitems(f, "", use_float=True))
+
+
+def _decode_inline(data):
+    """Inline data of a reference, with any "base64:" encoding undone"""
+    if isinstance(data, (bytes, str)) and data[:7] in (b"base64:", "base64:"):
+        return base64.b64decode(data[7:])
+    return data
+
+
+@lru_cache(1000)
+def _jinja_template(source):
+    """Compiled jinja template for the given source, shared between renders"""
+    import jinja2
+
+    return jinja2.Template(source)
+
+
+def _render_template(source, **kwargs):
+    """Render a template of the references, which other templates may call"""
+    return _jinja_template(source).render(**kwargs)
+
+
+def _ref_size(ref):
+    """Size of a reference, or None if it is a whole remote file"""
+    if isinstance(ref, (bytes, str)):
+        return len(ref)
+    if len(ref) == 1:
+        return None
+    return ref[2]
+
+
 def _prot_in_references(path, references):
     ref = references.get(path)
     if isinstance(ref, (list, tuple)):
@@ -425,26 +473,37 @@ class LazyReferenceMapper(collections.abc.MutableMapping):
             offsets = np.zeros(self.record_size, dtype="int64")
             sizes = np.zeros(self.record_size, dtype="int64")
             raws = np.full(self.record_size, np.nan, dtype="O")
+        # split the buffered changes by kind, then assign each column in bulk
+        url_inds, urls, url_offsets, url_sizes = [], [], [], []
+        raw_inds, raw_values, deleted = [], [], []
         for j, data in partition.items():
             if isinstance(data, list):
-                if (
-                    str(paths.dtype) == "category"
-                    and data[0] not in paths.dtype.categories
-                ):
-                    paths = paths.add_categories(data[0])
-                paths[j] = data[0]
-                if len(data) > 1:
-                    offsets[j] = data[1]
-                    sizes[j] = data[2]
+                url_inds.append(j)
+                urls.append(data[0])
+                url_offsets.append(data[1] if len(data) > 1 else 0)
+                url_sizes.append(data[2] if len(data) > 1 else 0)
             elif data is None:
-                # delete
-                paths[j] = None
-                offsets[j] = 0
-                sizes[j] = 0
-                raws[j] = None
+                deleted.append(j)
             else:
+                raw_inds.append(j)
                 # this is the only call into kerchunk, could remove
-                raws[j] = kerchunk.df._proc_raw(data)
+                raw_values.append(kerchunk.df._proc_raw(data))
+        if url_inds:
+            if str(paths.dtype) == "category":
+                new_urls = set(urls).difference(paths.dtype.categories)
+                if new_urls:
+                    paths = paths.add_categories(sorted(new_urls))
+            paths[url_inds] = urls
+            offsets[url_inds] = url_offsets
+            sizes[url_inds] = url_sizes
+            raws[url_inds] = None
+        if raw_inds:
+            raws[raw_inds] = raw_values
+        if deleted:
+            paths[deleted] = None
+            offsets[deleted] = 0
+            sizes[deleted] = 0
+            raws[deleted] = None
         # TODO: only save needed columns
         df = pd.DataFrame(
             {
@@ -557,6 +616,189 @@ class LazyReferenceMapper(collections.abc.MutableMapping):
             yield field + "/" + ".".join([str(c) for c in ind])
 
 
+class _RefDict(dict):
+    """Dict of references which counts its modifications
+
+    Lets the filesystem notice edits made directly to ``.references`` and
+    rebuild its directory listings.
+    """
+
+    changes = 0
+
+    def __setitem__(self, key, value):
+        self.changes += 1
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.changes += 1
+        super().__delitem__(key)
+
+    def __ior__(self, other):
+        self.changes += 1
+        return super().__ior__(other)
+
+    def pop(self, *args):
+        self.changes += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.changes += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.changes += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.changes += 1
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self.changes += 1
+        super().clear()
+
+
+class _LazyRefMapping(collections.abc.MutableMapping):
+    """Spec v1 references, with ``gen`` entries rendered when accessed
+
+    On first use, only the key template of each generator is rendered, to
+    record which product of the dimensions (as its ordinal number) makes
+    each key; the URL, offset and length of a generated reference are
+    rendered on lookup. Generated keys take precedence over explicit
+    references of the same name, so that first lookup of any key, explicit
+    or not, is O(N) in the number of generated references.
+    """
+
+    cache_size = 1000
+
+    def __init__(self, refs, gens, templates):
+        self._refs = refs
+        self._templates = templates
+        self._gens = []
+        # ordinal of the first product of each generator
+        self._starts = []
+        count = 0
+        self.changes = 0
+        for gen in gens:
+            if ("offset" in gen) ^ ("length" in gen):
+                raise ValueError(
+                    "Both 'offset' and 'length' are required for a "
+                    "reference generator entry if either is provided."
+                )
+            dimension = {
+                k: v
+                if isinstance(v, list)
+                else range(v.get("start", 0), v["stop"], v.get("step", 1))
+                for k, v in gen["dimensions"].items()
+            }
+            self._gens.append((gen, dimension))
+            self._starts.append(count)
+            count += math.prod(len(v) for v in dimension.values())
+        self._count = count
+        self._index = None
+        self._cache = {}
+
+    @property
+    def _generated(self):
+        """Mapping of generated key to the ordinal of its product"""
+        if self._index is None:
+            self._index = {}
+            ordinal = 0
+            for gen, dimension in self._gens:
+                key = _jinja_template(gen["key"])
+                for values in itertools.product(*dimension.values()):
+                    pr = dict(zip(dimension.keys(), values))
+                    self._index[key.render(**pr, **self._templates)] = ordinal
+                    ordinal += 1
+            for k in self._index:
+                self._refs.pop(k, None)
+        return self._index
+
+    def _product(self, ordinal):
+        """Generator and template values of the given product"""
+        i = bisect.bisect_right(self._starts, ordinal) - 1
+        gen, dimension = self._gens[i]
+        # unravel, with the last dimension varying fastest, as in product
+        n = ordinal - self._starts[i]
+        pr = {}
+        for k, v in reversed(dimension.items()):
+            n, j = divmod(n, len(v))
+            pr[k] = v[j]
+        return gen, pr
+
+    def _render(self, ordinal):
+        """Reference for the given product of all the generators"""
+        gen, pr = self._product(ordinal)
+        url = _jinja_template(gen["url"]).render(**pr, **self._templates)
+        if "offset" not in gen:
+            return [url]
+        offset = _jinja_template(gen["offset"]).render(**pr, **self._templates)
+        length = _jinja_template(gen["length"]).render(**pr, **self._templates)
+        return [url, int(offset), int(length)]
+
+    def _first(self):
+        """Explicit references and the first generated one of each generator
+
+        Does not render any key, so is cheap enough to look for protocols.
+        """
+        yield from self._refs.values()
+        for start, end in zip(self._starts, self._starts[1:] + [self._count]):
+            if end > start:
+                yield self._render(start)
+
+    def _sizes(self):
+        """Key and size of every reference, rendering only generated lengths"""
+        generated = self._generated  # first, since it may replace explicit refs
+        for key, ref in self._refs.items():
+            yield key, _ref_size(ref)
+        for key, ordinal in generated.items():
+            gen, pr = self._product(ordinal)
+            if "length" not in gen:
+                yield key, None
+            else:
+                length = _jinja_template(gen["length"])
+                yield key, int(length.render(**pr, **self._templates))
+
+    def __getitem__(self, key):
+        if key not in self._generated:
+            return self._refs[key]
+        if key not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                # drop the oldest entry
+                del self._cache[next(iter(self._cache))]
+            self._cache[key] = self._render(self._generated[key])
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        self.changes += 1
+        self._generated.pop(key, None)
+        self._cache.pop(key, None)
+        self._refs[key] = value
+
+    def __delitem__(self, key):
+        self.changes += 1
+        if key in self._generated:
+            del self._generated[key]
+            self._cache.pop(key, None)
+        else:
+            del self._refs[key]
+
+    def __contains__(self, key):
+        return key in self._generated or key in self._refs
+
+    def __iter__(self):
+        generated = self._generated  # first, since it may replace explicit refs
+        yield from self._refs
+        yield from generated
+
+    def __len__(self):
+        return len(self._refs) + len(self._generated)
+
+    def copy(self):
+        """All the references, rendered into a plain dict"""
+        return dict(self.items())
+
+
 class ReferenceFileSystem(AsyncFileSystem):
     """View byte ranges of some other file as a file system
     Initial version: single file system target, which must support
@@ -655,6 +897,7 @@ class ReferenceFileSystem(AsyncFileSystem):
         self.templates = {}
         self.fss = {}
         self._dircache = {}
+        self._dircache_changes = None
         self.max_gap = max_gap
         self.max_block = max_block
         if isinstance(fo, str):
@@ -666,7 +909,7 @@ class ReferenceFileSystem(AsyncFileSystem):
                 # text JSON
                 with fsspec.open(fo, "rb", **dic) as f:
                     logger.info("Read reference from URL %s", fo)
-                    text = json.load(f)
+                    text = _load_json(f)
                 self._process_references(text, template_overrides)
             else:
                 # Lazy parquet refs
@@ -710,7 +953,12 @@ class ReferenceFileSystem(AsyncFileSystem):
         if remote_protocol is None:
             # get single protocol from references
             # TODO: warning here, since this can be very expensive?
-            for ref in self.references.values():
+            if isinstance(self.references, _LazyRefMapping):
+                # without rendering every generated key
+                refs = self.references._first()
+            else:
+                refs = self.references.values()
+            for ref in refs:
                 if callable(ref):
                     ref = ref()
                 if isinstance(ref, list) and ref[0]:
@@ -738,8 +986,6 @@ class ReferenceFileSystem(AsyncFileSystem):
             part = part.encode()
         if isinstance(part, bytes):
             logger.debug(f"Reference: {path}, type bytes")
-            if part.startswith(b"base64:"):
-                part = base64.b64decode(part[7:])
             return part, None, None
 
         if len(part) == 1:
@@ -775,7 +1021,9 @@ class ReferenceFileSystem(AsyncFileSystem):
             return part_or_url[start:end]
         protocol, _ = split_protocol(part_or_url)
         try:
-            await self.fss[protocol]._cat_file(part_or_url, start=start, end=end)
+            return await self.fss[protocol]._cat_file(
+                part_or_url, start=start0, end=end0
+            )
         except Exception as e:
             raise ReferenceNotReachable(path, part_or_url) from e
 
@@ -792,6 +1040,7 @@ class ReferenceFileSystem(AsyncFileSystem):
     def pipe_file(self, path, value, **_):
         """Temporarily add binary data or reference as a file"""
         self.references[path] = value
+        self.dircache.clear()
 
     async def _get_file(self, rpath, lpath, **kwargs):
         if self.isdir(rpath):
@@ -827,86 +1076,90 @@ class ReferenceFileSystem(AsyncFileSystem):
             if remote in data:
                 fs.pipe_file(local, data[remote])
 
-    def cat(self, path, recursive=False, on_error="raise", **kwargs):
-        if isinstance(path, str) and recursive:
-            raise NotImplementedError
-        if isinstance(path, list) and (recursive or any("*" in p for p in path)):
-            raise NotImplementedError
-        # TODO: if references is lazy, pre-fetch all paths in batch before access
-        proto_dict = _protocol_groups(path, self.references)
-        out = {}
-        for proto, paths in proto_dict.items():
-            fs = self.fss[proto]
-            urls, starts, ends, valid_paths = [], [], [], []
-            for p in paths:
-                # find references or label not-found. Early exit if any not
-                # found and on_error is "raise"
-                try:
-                    u, s, e = self._cat_common(p)
-                except FileNotFoundError as err:
-                    if on_error == "raise":
-                        raise
-                    if on_error != "omit":
-                        out[p] = err
-                else:
-                    urls.append(u)
-                    starts.append(s)
-                    ends.append(e)
-                    valid_paths.append(p)
-
-            # process references into form for merging
-            urls2 = []
-            starts2 = []
-            ends2 = []
-            paths2 = []
-            whole_files = set()
-            for u, s, e, p in zip(urls, starts, ends, valid_paths):
-                if isinstance(u, bytes):
-                    # data
-                    out[p] = u
-                elif s is None:
-                    # whole file - limits are None, None, but no further
-                    # entries take for this file
-                    whole_files.add(u)
-                    urls2.append(u)
-                    starts2.append(s)
-                    ends2.append(e)
-                    paths2.append(p)
-            for u, s, e, p in zip(urls, starts, ends, valid_paths):
-                # second run to account for files that are to be loaded whole
-                if s is not None and u not in whole_files:
-                    urls2.append(u)
-                    starts2.append(s)
-                    ends2.append(e)
-                    paths2.append(p)
-
-            # merge and fetch consolidated ranges
-            new_paths, new_starts, new_ends = merge_offset_ranges(
-                list(urls2),
-                list(starts2),
-                list(ends2),
-                sort=True,
-                max_gap=self.max_gap,
-                max_block=self.max_block,
-            )
-            bytes_out = fs.cat_ranges(new_paths, new_starts, new_ends)
-
-            # unbundle from merged bytes - simple approach
-            for u, s, e, p in zip(urls, starts, ends, valid_paths):
-                if p in out:
-                    continue  # was bytes, already handled
-                for np, ns, ne, b in zip(new_paths, new_starts, new_ends, bytes_out):
-                    if np == u and (ns is None or ne is None):
-                        if isinstance(b, Exception):
-                            out[p] = b
-                        else:
-                            out[p] = b[s:e]
-                    elif np == u and s >= ns and e <= ne:
-                        if isinstance(b, Exception):
-                            out[p] = b
-                        else:
-                            out[p] = b[s - ns : (e - ne) or None]
+    def _plan_ranges(self, paths, on_error, out):
+        """Resolve paths of one protocol into merged byte ranges to fetch
+
+        Inline data and lookup errors are placed directly into ``out``.
+        """
+        urls, starts, ends, valid_paths = [], [], [], []
+        for p in paths:
+            # find references or label not-found. Early exit if any not
+            # found and on_error is "raise"
+            try:
+                u, s, e = self._cat_common(p)
+            except FileNotFoundError as err:
+                if on_error == "raise":
+                    raise
+                if on_error != "omit":
+                    out[p] = err
+            else:
+                urls.append(u)
+                starts.append(s)
+                ends.append(e)
+                valid_paths.append(p)
+
+        # process references into form for merging
+        urls2 = []
+        starts2 = []
+        ends2 = []
+        paths2 = []
+        whole_files = set()
+        for u, s, e, p in zip(urls, starts, ends, valid_paths):
+            if isinstance(u, bytes):
+                # data
+                out[p] = u
+            elif s is None:
+                # whole file - limits are None, None, but no further
+                # entries take for this file
+                whole_files.add(u)
+                urls2.append(u)
+                starts2.append(s)
+                ends2.append(e)
+                paths2.append(p)
+        for u, s, e, p in zip(urls, starts, ends, valid_paths):
+            # second run to account for files that are to be loaded whole
+            if s is not None and u not in whole_files:
+                urls2.append(u)
+                starts2.append(s)
+                ends2.append(e)
+                paths2.append(p)
+
+        # merge into consolidated ranges
+        merged = merge_offset_ranges(
+            list(urls2),
+            list(starts2),
+            list(ends2),
+            sort=True,
+            max_gap=self.max_gap,
+            max_block=self.max_block,
+        )
+        refs = list(zip(urls, starts, ends, valid_paths))
+        return refs, whole_files, merged
 
+    @staticmethod
+    def _unbundle_ranges(refs, whole_files, merged, bytes_out, out):
+        """Slice the bytes of each reference out of the fetched merged ranges"""
+        # the blocks of each URL are sorted by start, so the one enclosing a
+        # range is found by bisection
+        block_starts, blocks = {}, {}
+        for u, s, e, b in zip(*merged, bytes_out):
+            block_starts.setdefault(u, []).append(s)
+            blocks.setdefault(u, []).append((s, e, b))
+        for u, s, e, p in refs:
+            if p in out:
+                continue  # was bytes, already handled
+            if u in whole_files:
+                b = blocks[u][0][2]
+            else:
+                i = bisect.bisect_right(block_starts[u], s) - 1
+                ns, ne, b = blocks[u][i]
+                s, e = s - ns, (e - ne) or None
+            if isinstance(b, Exception):
+                out[p] = b
+            else:
+                out[p] = b[s:e]
+
+    def _cat_output(self, path, out, on_error):
         for k, v in out.copy().items():
             # these were valid references, but fetch failed, so transform exc
             if isinstance(v, Exception) and k in self.references:
@@ -922,6 +1175,47 @@ class ReferenceFileSystem(AsyncFileSystem):
             return _first(out)
         return out
 
+    def cat(self, path, recursive=False, on_error="raise", **kwargs):
+        if isinstance(path, str) and recursive:
+            raise NotImplementedError
+        if isinstance(path, list) and (recursive or any("*" in p for p in path)):
+            raise NotImplementedError
+        # TODO: if references is lazy, pre-fetch all paths in batch before access
+        proto_dict = _protocol_groups(path, self.references)
+        out = {}
+        for proto, paths in proto_dict.items():
+            fs = self.fss[proto]
+            refs, whole_files, merged = self._plan_ranges(paths, on_error, out)
+            bytes_out = fs.cat_ranges(*merged)
+            self._unbundle_ranges(refs, whole_files, merged, bytes_out, out)
+        return self._cat_output(path, out, on_error)
+
+    async def _cat(
+        self, path, recursive=False, on_error="raise", batch_size=None, **kwargs
+    ):
+        """Async version of ``cat``
+
+        Ranges are merged as in ``cat``; for async targets, at most
+        ``batch_size`` of the resulting requests are in flight at once.
+        """
+        if isinstance(path, str) and recursive:
+            raise NotImplementedError
+        if isinstance(path, list) and (recursive or any("*" in p for p in path)):
+            raise NotImplementedError
+        proto_dict = _protocol_groups(path, self.references)
+        out = {}
+        for proto, paths in proto_dict.items():
+            fs = self.fss[proto]
+            refs, whole_files, merged = self._plan_ranges(paths, on_error, out)
+            if fs.async_impl:
+                bytes_out = await fs._cat_ranges(
+                    *merged, batch_size=batch_size or self.batch_size
+                )
+            else:
+                bytes_out = fs.cat_ranges(*merged)
+            self._unbundle_ranges(refs, whole_files, merged, bytes_out, out)
+        return self._cat_output(path, out, on_error)
+
     def _process_references(self, references, template_overrides=None):
         vers = references.get("version", None)
         if vers is None:
@@ -935,38 +1229,37 @@ class ReferenceFileSystem(AsyncFileSystem):
 
     def _process_references0(self, references):
         """Make reference dict for Spec Version 0"""
-        self.references = references
+        # a new dict, so that the caller's references are left untouched
+        self.references = _RefDict(
+            (k, self._process_inline(v)) for k, v in references.items()
+        )
 
     def _process_references1(self, references, template_overrides=None):
-        if not self.simple_templates or self.templates:
-            import jinja2
-        self.references = {}
         self._process_templates(references.get("templates", {}))
+        self.references = _RefDict(
+            (k, self._process_ref1(v)) for k, v in references.get("refs", {}).items()
+        )
+        gens = references.get("gen", [])
+        if gens:
+            self.references = _LazyRefMapping(self.references, gens, self.templates)
 
-        @lru_cache(1000)
-        def _render_jinja(u):
-            return jinja2.Template(u).render(**self.templates)
-
-        for k, v in references.get("refs", {}).items():
-            if isinstance(v, str):
-                if v.startswith("base64:"):
-                    self.references[k] = base64.b64decode(v[7:])
-                self.references[k] = v
-            elif self.templates:
-                u = v[0]
-                if "{{" in u:
-                    if self.simple_templates:
-                        u = (
-                            u.replace("{{", "{")
-                            .replace("}}", "}")
-                            .format(**self.templates)
-                        )
-                    else:
-                        u = _render_jinja(u)
-                self.references[k] = [u] if len(v) == 1 else [u, v[1], v[2]]
+    @staticmethod
+    def _process_inline(ref):
+        if isinstance(ref, dict):
+            # inline JSON, such as zarr metadata: encode once, not per read
+            return json.dumps(ref, separators=(",", ":")).encode()
+        return _decode_inline(ref)
+
+    def _process_ref1(self, ref):
+        if isinstance(ref, (bytes, str, dict)) or not self.templates:
+            return self._process_inline(ref)
+        u = ref[0]
+        if "{{" in u:
+            if self.simple_templates:
+                u = u.replace("{{", "{").replace("}}", "}").format(**self.templates)
             else:
-                self.references[k] = v
-        self.references.update(self._process_gen(references.get("gen", [])))
+                u = _jinja_template(u).render(**self.templates)
+        return [u] if len(ref) == 1 else [u, ref[1], ref[2]]
 
     def _process_templates(self, tmp):
         self.templates = {}
@@ -974,59 +1267,25 @@ class ReferenceFileSystem(AsyncFileSystem):
             tmp.update(self.template_overrides)
         for k, v in tmp.items():
             if "{{" in v:
-                import jinja2
-
-                self.templates[k] = lambda temp=v, **kwargs: jinja2.Template(
-                    temp
-                ).render(**kwargs)
+                self.templates[k] = partial(_render_template, v)
             else:
                 self.templates[k] = v
 
-    def _process_gen(self, gens):
-        out = {}
-        for gen in gens:
-            dimension = {
-                k: v
-                if isinstance(v, list)
-                else range(v.get("start", 0), v["stop"], v.get("step", 1))
-                for k, v in gen["dimensions"].items()
-            }
-            products = (
-                dict(zip(dimension.keys(), values))
-                for values in itertools.product(*dimension.values())
-            )
-            for pr in products:
-                import jinja2
-
-                key = jinja2.Template(gen["key"]).render(**pr, **self.templates)
-                url = jinja2.Template(gen["url"]).render(**pr, **self.templates)
-                if ("offset" in gen) and ("length" in gen):
-                    offset = int(
-                        jinja2.Template(gen["offset"]).render(**pr, **self.templates)
-                    )
-                    length = int(
-                        jinja2.Template(gen["length"]).render(**pr, **self.templates)
-                    )
-                    out[key] = [url, offset, length]
-                elif ("offset" in gen) ^ ("length" in gen):
-                    raise ValueError(
-                        "Both 'offset' and 'length' are required for a "
-                        "reference generator entry if either is provided."
-                    )
-                else:
-                    out[key] = [url]
-        return out
+    def _refresh_dircache(self):
+        """Build the directory listings, if missing or the references changed"""
+        changes = getattr(self.references, "changes", None)
+        if not self.dircache or changes != self._dircache_changes:
+            self._dircache_from_items()
+            self._dircache_changes = changes
 
     def _dircache_from_items(self):
         self.dircache = {"": []}
-        it = self.references.items()
-        for path, part in it:
-            if isinstance(part, (bytes, str)):
-                size = len(part)
-            elif len(part) == 1:
-                size = None
-            else:
-                _, _, size = part
+        if isinstance(self.references, _LazyRefMapping):
+            # without rendering the URLs and offsets of generated references
+            it = self.references._sizes()
+        else:
+            it = ((path, _ref_size(part)) for path, part in self.references.items())
+        for path, size in it:
             par = path.rsplit("/", 1)[0] if "/" in path else ""
             par0 = par
             subdirs = [par0]
@@ -1059,8 +1318,7 @@ class ReferenceFileSystem(AsyncFileSystem):
             except KeyError:
                 pass
             raise FileNotFoundError(f"'{path}' is not a known key")
-        if not self.dircache:
-            self._dircache_from_items()
+        self._refresh_dircache()
         out = self._ls_from_cache(path)
         if out is None:
             raise FileNotFoundError(path)
@@ -1069,17 +1327,18 @@ class ReferenceFileSystem(AsyncFileSystem):
         return [o["name"] for o in out]
 
     def exists(self, path, **kwargs):  # overwrite auto-sync version
-        return self.isdir(path) or self.isfile(path)
+        if isinstance(self.references, LazyReferenceMapper):
+            return self.isdir(path) or self.isfile(path)
+        # files first, since directories need the listings
+        return self.isfile(path) or self.isdir(path)
 
     def isdir(self, path):  # overwrite auto-sync version
-        if self.dircache:
-            return path in self.dircache
-        elif isinstance(self.references, LazyReferenceMapper):
+        if isinstance(self.references, LazyReferenceMapper):
+            if self.dircache:
+                return path in self.dircache
             return path in self.references.listdir("")
-        else:
-            # this may be faster than building dircache for single calls, but
-            # by looping will be slow for many calls; could cache it?
-            return any(_.startswith(f"{path}/") for _ in self.references)
+        self._refresh_dircache()
+        return path in self.dircache
 
     def isfile(self, path):  # overwrite auto-sync version
         return path in self.references
@@ -1092,23 +1351,39 @@ class ReferenceFileSystem(AsyncFileSystem):
             return super().find(
                 path, maxdepth=maxdepth, withdirs=withdirs, detail=detail, **kwargs
             )
-        if path:
-            path = self._strip_protocol(path)
-            r = sorted(k for k in self.references if k.startswith(path))
-        else:
-            r = sorted(self.references)
-        if detail:
-            if not self.dircache:
-                self._dircache_from_items()
-            return {k: self._ls_from_cache(k)[0] for k in r}
-        else:
+        path = self._strip_protocol(path)
+        if isinstance(self.references, LazyReferenceMapper):
+            if path:
+                r = sorted(k for k in self.references if k.startswith(path))
+            else:
+                r = sorted(self.references)
+            if detail:
+                if not self.dircache:
+                    self._dircache_from_items()
+                return {k: self._ls_from_cache(k)[0] for k in r}
             return r
+        self._refresh_dircache()
+        out = {}
+        if path in self.references:
+            out[path] = self._ls_from_cache(path)[0]
+        # walk only the subtree below path, one directory listing at a time
+        stack = [(path, 1)] if path in self.dircache else []
+        while stack:
+            directory, depth = stack.pop()
+            for entry in self.dircache[directory]:
+                if entry["type"] == "directory":
+                    if maxdepth is None or depth < maxdepth:
+                        stack.append((entry["name"], depth + 1))
+                else:
+                    out[entry["name"]] = entry
+        if detail:
+            return {k: out[k] for k in sorted(out)}
+        return sorted(out)
 
     def info(self, path, **kwargs):
         out = self.references.get(path)
         if out is not None:
             if isinstance(out, (str, bytes)):
-                # decode base64 here
                 return {"name": path, "type": "file", "size": len(out)}
             elif len(out) > 1:
                 return {"name": path, "type": "file", "size": out[2]}
@@ -1136,24 +1411,51 @@ class ReferenceFileSystem(AsyncFileSystem):
 
     async def _pipe_file(self, path, data):
         # can be str or bytes
-        self.references[path] = data
+        self.references[path] = _decode_inline(data)
         self.dircache.clear()  # this is a bit heavy handed
 
     async def _put_file(self, lpath, rpath, **kwargs):
         # puts binary
         with open(lpath, "rb") as f:
-            self.references[rpath] = f.read()
+            self.references[rpath] = _decode_inline(f.read())
         self.dircache.clear()  # this is a bit heavy handed
 
+    def consolidate_metadata(self):
+        """Gather all zarr metadata into a single ``.zmetadata`` reference
+
+        The contents of every ``.zgroup``, ``.zarray`` and ``.zattrs`` key are
+        fetched in one batch and stored as compact inline JSON in the same
+        layout as ``zarr.consolidate_metadata``, so that a reader needs only
+        one request to discover the whole hierarchy. Lazy (parquet) references
+        are always consolidated, so this is a no-op for them.
+        """
+        if isinstance(self.references, LazyReferenceMapper):
+            return
+        keys = [
+            k
+            for k in self.references
+            if k.rsplit("/", 1)[-1] in (".zgroup", ".zarray", ".zattrs")
+        ]
+        metadata = {k: json.loads(v) for k, v in self.cat(keys).items()}
+        self.references[".zmetadata"] = json.dumps(
+            {"metadata": metadata, "zarr_consolidated_format": 1},
+            separators=(",", ":"),
+        ).encode()
+        self.dircache.clear()
+
     def save_json(self, url, **storage_options):
         """Write modified references into new location"""
         out = {}
         for k, v in self.references.items():
             if isinstance(v, bytes):
                 try:
-                    out[k] = v.decode("ascii")
+                    text = v.decode("ascii")
                 except UnicodeDecodeError:
-                    out[k] = (b"base64:" + base64.b64encode(v)).decode()
+                    text = None
+                if text is None or text.startswith("base64:"):
+                    # binary, or text that would be taken as encoded when loaded
+                    text = (b"base64:" + base64.b64encode(v)).decode()
+                out[k] = text
             else:
                 out[k] = v
         with fsspec.open(url, "wb", **storage_options) as f:
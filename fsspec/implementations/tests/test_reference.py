@@ -1,5 +1,10 @@
+import asyncio
+import base64
+import copy
 import json
 import os
+import pickle
+import tracemalloc
 
 import pytest
 
@@ -9,24 +14,71 @@ from fsspec.implementations.reference import (
     LazyReferenceMapper,
     ReferenceFileSystem,
     ReferenceNotReachable,
+    _jinja_template,
 )
 from fsspec.tests.conftest import data, realfile, reset_files, server, win  # noqa: F401
+from fsspec.utils import tokenize
 
 
-def test_simple(server):  # noqa: F811
+@pytest.fixture(scope="module")
+def reference_fs():
+    """Factory of ReferenceFileSystems, made once per module for given arguments
+
+    The arguments are kept alive with the instance, so their ids stay unique.
+    """
+    made = {}
+
+    def make(refs, fs=None, **kwargs):
+        key = (id(refs), id(fs), tokenize(kwargs))
+        if key not in made:
+            made[key] = (
+                refs,
+                fs,
+                fsspec.filesystem(
+                    "reference", fo=refs, fs=fs, skip_instance_cache=True, **kwargs
+                ),
+            )
+        return made[key][-1]
+
+    return make
+
+
+@pytest.fixture
+def fetched(m, monkeypatch):
+    """Paths read with cat_file from the memory filesystem, in order"""
+    paths = []
+    cat_file = m.cat_file
+
+    def counting_cat_file(path, *args, **kwargs):
+        paths.append(path)
+        return cat_file(path, *args, **kwargs)
+
+    monkeypatch.setattr(m, "cat_file", counting_cat_file)
+    return paths
+
+
+def test_simple(server, reference_fs):  # noqa: F811
     refs = {
         "a": b"data",
         "b": (realfile, 0, 5),
         "c": (realfile, 1, 5),
         "d": b"base64:aGVsbG8=",
+        "e": {"key": "value"},
     }
     h = fsspec.filesystem("http")
-    fs = fsspec.filesystem("reference", fo=refs, fs=h)
+    fs = reference_fs(refs, h)
 
     assert fs.cat("a") == b"data"
     assert fs.cat("b") == data[:5]
     assert fs.cat("c") == data[1 : 1 + 5]
     assert fs.cat("d") == b"hello"
+    assert fs.references["d"] == b"hello"  # decoded once, on load
+    assert fs.size("d") == 5
+    assert fs.cat("e") == b'{"key":"value"}'
+    assert fs.size("e") == len(b'{"key":"value"}')
+    # the given references are not modified
+    assert refs["d"] == b"base64:aGVsbG8="
+    assert refs["e"] == {"key": "value"}
     with fs.open("d", "rt") as f:
         assert f.read(2) == "he"
 
@@ -42,15 +94,92 @@ def test_target_options(m):
     assert fs.cat("a") == b"hello"
 
 
-def test_ls(server):  # noqa: F811
-    refs = {"a": b"data", "b": (realfile, 0, 5), "c/d": (realfile, 1, 6)}
-    h = fsspec.filesystem("http")
-    fs = fsspec.filesystem("reference", fo=refs, fs=h)
+def test_target_options_streamed(m, monkeypatch):
+    ijson = pytest.importorskip("ijson")
+    if ijson.backend != "yajl2_c":
+        pytest.skip("ijson C backend required")
+    m.pipe("data/0", b"hello")
+    refs = {
+        "version": 1,
+        "refs": {
+            "a": ["memory://data/0"],
+            "b": ["memory://data/0", 1, 3],
+            "c": {"scale": 0.5},
+        },
+    }
+    fn = "memory://refs.json.gz"
+    with fsspec.open(fn, "wt", compression="gzip") as f:
+        json.dump(refs, f)
+
+    kvitems = ijson.kvitems
+    prefixes = []
+
+    def spy(f, prefix, **kwargs):
+        prefixes.append(prefix)
+        return kvitems(f, prefix, **kwargs)
+
+    monkeypatch.setattr(ijson, "kvitems", spy)
+    fs = fsspec.filesystem(
+        "reference",
+        fo=fn,
+        target_options={"compression": "gzip"},
+        skip_instance_cache=True,
+    )
+    assert fs.cat("a") == b"hello"
+    assert fs.cat("b") == b"ell"
+    assert json.loads(fs.cat("c")) == {"scale": 0.5}
+    assert prefixes == [""]
+
+
+def test_target_options_streamed_memory(m):
+    ijson = pytest.importorskip("ijson")
+    if ijson.backend != "yajl2_c":
+        pytest.skip("ijson C backend required")
+    url = "memory://target/with/a/longer/path/to/the/data/0"
+    refs = {"version": 1, "refs": {f"k/{i}": [url, i, 5] for i in range(50_000)}}
+    text = json.dumps(refs).encode()
+    fn = "memory://refs.json.gz"
+    with fsspec.open(fn, "wb", compression="gzip") as f:
+        f.write(text)
+    del refs
+
+    tracemalloc.start()
+    try:
+        fs = fsspec.filesystem(
+            "reference",
+            fo=fn,
+            target_options={"compression": "gzip"},
+            skip_instance_cache=True,
+        )
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(fs.references) == 50_000
+    # the decompressed text is never held next to the parsed references
+    assert peak - size < len(text)
+    assert peak < 2 * size
+
+
+# shared by tests through the reference_fs fixture, so they reuse one instance
+tree_refs = {
+    "a": b"data",
+    "b": (realfile, 0, 5),
+    "c/d": (realfile, 1, 6),
+    "e": (realfile,),
+}
+
+
+def tree_http():
+    return fsspec.filesystem("http", headers={"give_length": "true", "head_ok": "true"})
+
 
-    assert fs.ls("", detail=False) == ["a", "b", "c"]
+def test_ls(server, reference_fs):  # noqa: F811
+    fs = reference_fs(tree_refs, tree_http())
+
+    assert fs.ls("", detail=False) == ["a", "b", "c", "e"]
     assert {"name": "c", "type": "directory", "size": 0} in fs.ls("", detail=True)
-    assert fs.find("") == ["a", "b", "c/d"]
-    assert fs.find("", withdirs=True) == ["a", "b", "c", "c/d"]
+    assert fs.find("") == ["a", "b", "c/d", "e"]
+    assert fs.find("", withdirs=True) == ["a", "b", "c", "c/d", "e"]
     assert fs.find("c", detail=True) == {
         "c/d": {"name": "c/d", "size": 6, "type": "file"}
     }
@@ -66,15 +195,66 @@ def test_nested_dirs_ls():
     assert {e["name"] for e in fs.ls("B")} == {"B/C", "B/_"}
 
 
-def test_info(server):  # noqa: F811
+def test_find_many(monkeypatch):
     refs = {
-        "a": b"data",
-        "b": (realfile, 0, 5),
-        "c/d": (realfile, 1, 6),
-        "e": (realfile,),
+        f"d{i}/s{j}/k{k}": b"x"
+        for i in range(10)
+        for j in range(10)
+        for k in range(100)
     }
-    h = fsspec.filesystem("http", headers={"give_length": "true", "head_ok": "true"})
-    fs = fsspec.filesystem("reference", fo=refs, fs=h)
+    refs.update({"top": b"x", "d0/s00/k0": b"x"})
+    fs = fsspec.filesystem("reference", fo=refs)
+    builds = []
+    dircache_from_items = fs._dircache_from_items
+
+    def counting_dircache_from_items():
+        builds.append(1)
+        dircache_from_items()
+
+    monkeypatch.setattr(fs, "_dircache_from_items", counting_dircache_from_items)
+    assert fs.find("") == sorted(refs)
+    for i in range(10):
+        assert fs.isdir(f"d{i}")
+        assert len(fs.ls(f"d{i}/s1")) == 100
+        for j in range(10):
+            out = fs.find(f"d{i}/s{j}")
+            assert out == sorted(f"d{i}/s{j}/k{k}" for k in range(100))
+    # only the given directory, not names that share its prefix
+    assert fs.find("d0/s0") == sorted(f"d0/s0/k{k}" for k in range(100))
+    assert fs.find("top") == ["top"]
+    assert fs.find("d0", maxdepth=1) == []
+    assert len(fs.find("d0", maxdepth=2)) == 1001
+    assert fs.find("nothere") == []
+    assert len(builds) == 1
+
+
+@pytest.mark.parametrize("gen", [False, True])
+def test_find_direct_edits(gen):
+    refs = {"a": b"data", "c/d": b"x"}
+    if gen:
+        pytest.importorskip("jinja2")
+        refs = {
+            "version": 1,
+            "refs": refs,
+            "gen": [{"key": "g{{i}}", "url": "memory://g", "dimensions": {"i": [0]}}],
+        }
+    fs = fsspec.filesystem("reference", fo=refs, skip_instance_cache=True)
+    top = ["a", "c/d"] + (["g0"] if gen else [])
+    assert fs.find("") == top
+    assert fs.isdir("c")
+
+    fs.references["c/e"] = b"y"
+    assert fs.find("") == sorted(top + ["c/e"])
+    assert fs.ls("c", detail=False) == ["c/d", "c/e"]
+
+    del fs.references["c/d"]
+    fs.references.pop("c/e")
+    assert not fs.isdir("c")
+    assert fs.find("") == [k for k in top if k != "c/d"]
+
+
+def test_info(server, reference_fs):  # noqa: F811
+    fs = reference_fs(tree_refs, tree_http())
     assert fs.size("a") == 4
     assert fs.size("b") == 5
     assert fs.size("c/d") == 6
@@ -96,6 +276,9 @@ def test_mutable(server, m):
     bin_data = b"bin data"
     fs.pipe("aa", bin_data)
     assert fs.cat("aa") == bin_data
+    # written data is decoded like loaded references
+    fs.pipe("ab", b"base64:aGVsbG8=")
+    assert fs.cat("ab") == b"hello"
 
     fs.save_json("memory://refs.json")
     assert m.exists("refs.json")
@@ -103,6 +286,7 @@ def test_mutable(server, m):
     fs = fsspec.filesystem("reference", fo="memory://refs.json", remote_protocol="http")
     assert not fs.exists("a")
     assert fs.cat("aa") == bin_data
+    assert fs.cat("ab") == b"hello"
 
 
 def test_put_get(tmpdir):
@@ -194,7 +378,7 @@ jdata = """{
 """
 
 
-def test_spec1_expand():
+def test_spec1_expand(reference_fs):
     pytest.importorskip("jinja2")
     in_data = {
         "version": 1,
@@ -219,17 +403,17 @@ def test_spec1_expand():
             "key2": ["http://{{u}}", 10000, 100],
             "key3": ["http://{{f(c='text')}}", 10000, 100],
             "key4": ["http://target_url"],
+            "key5": {"zarr_format": 2},
         },
     }
-    fs = fsspec.filesystem(
-        "reference", fo=in_data, target_protocol="http", simple_templates=False
-    )
-    assert fs.references == {
+    fs = reference_fs(in_data, target_protocol="http", simple_templates=False)
+    assert dict(fs.references) == {
         "key0": "data",
         "key1": ["http://target_url", 10000, 100],
         "key2": ["http://server.domain/path", 10000, 100],
         "key3": ["http://text", 10000, 100],
         "key4": ["http://target_url"],
+        "key5": b'{"zarr_format":2}',
         "gen_key0": ["http://server.domain/path_0", 1000, 1000],
         "gen_key1": ["http://server.domain/path_1", 2000, 1000],
         "gen_key2": ["http://server.domain/path_2", 3000, 1000],
@@ -239,6 +423,19 @@ def test_spec1_expand():
         "gen_key6": ["http://server.domain/path_6"],
     }
 
+    # compiled templates are reused between instances
+    hits = _jinja_template.cache_info().hits
+    fs2 = fsspec.filesystem(
+        "reference",
+        fo=in_data,
+        target_protocol="http",
+        simple_templates=False,
+        skip_instance_cache=True,
+    )
+    assert fs2 is not fs
+    assert fs2.references == fs.references
+    assert _jinja_template.cache_info().hits > hits
+
 
 def test_spec1_expand_simple():
     pytest.importorskip("jinja2")
@@ -260,9 +457,30 @@ def test_spec1_expand_simple():
         template_overrides={"u": "not.org/p"},
     )
     assert fs.references["key2"] == ["http://not.org/p", 10000, 100]
+    assert fs.references["key0"] == b"data"
     assert fs.cat("key0") == b"data"
 
 
+def test_spec1_base64_bytes():
+    refs = {"version": 1, "refs": {"a": b"base64:aGVsbG8=", "b": b"data"}}
+    fs = fsspec.filesystem("reference", fo=refs)
+    assert fs.cat("a") == b"hello"
+    assert fs.cat("b") == b"data"
+
+
+def test_base64_decoded_once():
+    # encoded data which is itself base64-like text
+    inner = b"base64:aGVsbG8="
+    refs = {"x": "base64:" + base64.b64encode(inner).decode()}
+    fs1 = fsspec.filesystem("reference", fo=refs)
+    assert fs1.cat("x") == inner
+    fs2 = fsspec.filesystem("reference", fo=refs)
+    assert fs2 is fs1
+    fs3 = fsspec.filesystem("reference", fo=refs, skip_instance_cache=True)
+    assert fs3.cat("x") == inner
+    assert fs1.cat("x") == inner
+
+
 def test_spec1_gen_variants():
     pytest.importorskip("jinja2")
     with pytest.raises(ValueError):
@@ -308,12 +526,124 @@ def test_spec1_gen_variants():
     }
 
     fs = fsspec.filesystem("reference", fo=url_only_gen_spec, target_protocol="http")
-    assert fs.references == {
+    assert dict(fs.references) == {
         "gen_key0": ["http://server.domain/path_0"],
         "gen_key1": ["http://server.domain/path_1"],
     }
 
 
+def test_spec1_gen_lazy():
+    pytest.importorskip("jinja2")
+    spec = {
+        "version": 1,
+        "gen": [
+            {
+                "key": "gen_key{{i}}",
+                # cannot be rendered for i == 3
+                "url": "http://server/{{ 6 // (i - 3) }}",
+                "dimensions": {"i": {"stop": 5}},
+            },
+        ],
+        "refs": {"key0": "data", "gen_key1": ["http://other"]},
+    }
+    fs = fsspec.filesystem("reference", fo=spec)
+    assert "http" in fs.fss
+    assert fs.references["gen_key0"] == ["http://server/-2"]
+    assert fs.references["gen_key1"] == ["http://server/-3"]
+    assert fs.references["key0"] == "data"
+    assert "gen_key3" in fs.references
+    assert len(fs.references) == 6
+    assert sorted(fs.references)[0] == "gen_key0"
+    with pytest.raises(ZeroDivisionError):
+        fs.references["gen_key3"]
+    # listings need only keys and sizes
+    assert "gen_key3" in fs.ls("", detail=False)
+
+    # independent copies
+    refs = pickle.loads(pickle.dumps(fs.references))
+    assert refs["gen_key4"] == ["http://server/6"]
+    refs = copy.deepcopy(fs.references)
+    del refs["gen_key0"]
+    assert "gen_key0" in fs.references
+
+    fs.pipe("gen_key3", b"fixed")
+    del fs.references["gen_key4"]
+    assert fs.cat("gen_key3") == b"fixed"
+    assert fs.find("") == ["gen_key0", "gen_key1", "gen_key2", "gen_key3", "key0"]
+
+
+def test_spec1_gen_pickle():
+    pytest.importorskip("jinja2")
+    spec = {
+        "version": 1,
+        "templates": {"f": "server_{{c}}"},
+        "gen": [
+            {
+                "key": "gen_key{{i}}",
+                "url": "http://{{f(c=i)}}",
+                "dimensions": {"i": {"stop": 3}},
+            },
+        ],
+    }
+    fs = fsspec.filesystem("reference", fo=spec, remote_protocol="http")
+    refs = pickle.loads(pickle.dumps(fs.references))
+    assert refs["gen_key2"] == ["http://server_2"]
+    assert refs == fs.references
+
+
+def test_spec1_gen_protocol():
+    pytest.importorskip("jinja2")
+    spec = {
+        "version": 1,
+        "gen": [
+            {
+                # cannot be rendered for i == 3
+                "key": "k{{ 6 // (i - 3) }}",
+                "url": "memory://{{i}}",
+                "dimensions": {"i": {"stop": 5}},
+            },
+        ],
+    }
+    # the protocol comes from the first generated URL, without rendering keys
+    fs = fsspec.filesystem("reference", fo=spec)
+    assert "memory" in fs.fss
+    with pytest.raises(ZeroDivisionError):
+        fs.references["k-2"]
+
+
+def test_spec1_gen_multi_dimension():
+    pytest.importorskip("jinja2")
+    spec = {
+        "version": 1,
+        "gen": [
+            {
+                "key": "a/{{i}}.{{j}}",
+                "url": "http://a_{{i}}_{{j}}",
+                "dimensions": {"i": {"stop": 3}, "j": ["x", "y"]},
+            },
+            {
+                "key": "b/{{k}}",
+                "url": "http://b",
+                "offset": "{{k * 10}}",
+                "length": "10",
+                "dimensions": {"k": {"start": 2, "stop": 9, "step": 3}},
+            },
+        ],
+    }
+    fs = fsspec.filesystem("reference", fo=spec, remote_protocol="http")
+    assert fs.exists("b/5")
+    assert not fs.dircache
+    expected = {
+        f"a/{i}.{j}": [f"http://a_{i}_{j}"] for i in range(3) for j in ["x", "y"]
+    }
+    expected.update({f"b/{k}": ["http://b", k * 10, 10] for k in [2, 5, 8]})
+    assert dict(fs.references) == expected
+    # a plain dict, for serialisation
+    refs = fs.references.copy()
+    assert type(refs) is dict
+    assert json.loads(json.dumps(refs)) == expected
+
+
 def test_empty():
     pytest.importorskip("jinja2")
     fs = fsspec.filesystem("reference", fo={"version": 1}, target_protocol="http")
@@ -433,7 +763,7 @@ def test_fss_has_defaults(m):
     assert fs.fss[None] is fs.fss["memory"]
 
 
-def test_merging(m):
+def test_merging(m, fetched):
     m.pipe("/a", b"test data")
     other = b"other test data"
     m.pipe("/b", other)
@@ -448,6 +778,28 @@ def test_merging(m):
     )
     out = fs.cat(["a", "b", "c", "d"])
     assert out == {"a": b"e", "b": b"s", "c": other, "d": other[4:10]}
+    # one request per target: "a" and "b" are merged, "d" is within whole "c"
+    assert sorted(fetched) == ["memory://a", "memory://b"]
+
+
+def test_merging_many(m):
+    data = bytes(range(256))
+    m.pipe("/a", data)
+    m.pipe("/b", data[::-1])
+    refs = {f"a{i}": ["memory://a", i * 3, 2] for i in range(80)}
+    refs.update({f"b{i}": ["memory://b", i, 10] for i in range(0, 240, 7)})
+    # range nested within another
+    m.pipe("/c", data)
+    refs.update({"outer": ["memory://c", 100, 100], "inner": ["memory://c", 110, 5]})
+    expected = {
+        k: (data[::-1] if u == "memory://b" else data)[s : s + n]
+        for k, (u, s, n) in refs.items()
+    }
+    for max_gap in [-1, 0, 64_000]:
+        fs = fsspec.filesystem(
+            "reference", fo=refs, max_gap=max_gap, skip_instance_cache=True
+        )
+        assert fs.cat(list(refs)) == expected
 
 
 def test_cat_file_ranges(m):
@@ -472,6 +824,48 @@ def test_cat_file_ranges(m):
     assert fs.cat_file("d", 1, -3) == other[4:10][1:-3]
 
 
+def test_async_cat_ranges(server):  # noqa: F811
+    refs = {f"k{i}": [realfile, i * 50, 20] for i in range(200)}
+    expected = {k: data[s : s + n] for k, (_, s, n) in refs.items()}
+
+    async def _():
+        h = fsspec.filesystem("http", asynchronous=True, skip_instance_cache=True)
+        session = await h.set_session()
+        cat_file = h._cat_file
+        calls, in_flight, peak = 0, 0, 0
+
+        async def counting_cat_file(*args, **kwargs):
+            nonlocal calls, in_flight, peak
+            calls += 1
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                return await cat_file(*args, **kwargs)
+            finally:
+                in_flight -= 1
+
+        h._cat_file = counting_cat_file
+        fs = fsspec.filesystem(
+            "reference",
+            fo=refs,
+            fs=h,
+            asynchronous=True,
+            max_gap=-1,
+            batch_size=32,
+            skip_instance_cache=True,
+        )
+        out = await fs._cat(list(refs))
+        assert out == expected
+        assert calls == len(refs)
+        assert 1 < peak <= 32
+
+        assert await fs._cat_file("k1") == data[50:70]
+        assert await fs._cat_file("k1", start=5) == data[55:70]
+        await session.close()
+
+    asyncio.run(_())
+
+
 @pytest.mark.parametrize(
     "fo",
     [
@@ -533,7 +927,7 @@ def test_cat_missing(m, fo):
     assert list(out) == ["c"]
 
 
-def test_df_single(m):
+def test_df_single(m, fetched):
     pd = pytest.importorskip("pandas")
     pytest.importorskip("fastparquet")
     data = b"data0data1data2"
@@ -573,6 +967,10 @@ def test_df_single(m):
     assert ".zmetadata" in allfiles
     assert ".zgroup" in allfiles
     assert "stuff/2" in allfiles
+    # metadata keys all come from one read of the consolidated .zmetadata
+    assert len(fetched) == 2
+    assert fetched[0].endswith(".zmetadata")
+    assert fetched[1].endswith("refs.0.parq")
 
     assert fs.cat("stuff/0") == b"raw"
     assert fs.cat("stuff/1") == data
@@ -640,6 +1038,30 @@ def test_df_multi(m):
     assert fs.cat("stuff/5") == data[2:4]
 
 
+def test_consolidate_metadata(m):
+    m.pipe("attrs", b'{"units": "m"}')
+    refs = {
+        ".zgroup": b'{"zarr_format": 2}',
+        "x/.zarray": {"chunks": [1], "shape": [2], "zarr_format": 2},
+        "x/.zattrs": ["memory://attrs"],
+        "x/0": b"\x00",
+    }
+    fs = fsspec.filesystem("reference", fo=refs, remote_protocol="memory")
+    assert fs.ls("", detail=False) == [".zgroup", "x"]
+    fs.consolidate_metadata()
+    assert sorted(fs.ls("", detail=False)) == [".zgroup", ".zmetadata", "x"]
+
+    meta = json.loads(fs.cat(".zmetadata"))
+    assert meta == {
+        "metadata": {
+            ".zgroup": {"zarr_format": 2},
+            "x/.zarray": {"chunks": [1], "shape": [2], "zarr_format": 2},
+            "x/.zattrs": {"units": "m"},
+        },
+        "zarr_consolidated_format": 1,
+    }
+
+
 def test_mapping_getitems(m):
     m.pipe({"a": b"A", "b": b"B"})
 
@@ -718,3 +1140,49 @@ def test_append_parquet(lazy_refs, m):
     with pytest.raises(KeyError):
         lazy2["data/0"]
     assert lazy2["data/1"] == b"Adata"
+    lazy2["data/1"] = ["memory://target", 1, 2]
+    lazy2["data/2"] = ["memory://target"]
+    lazy2["data/3"] = b"Cdata"
+    lazy2.flush()
+
+    lazy2 = LazyReferenceMapper("memory://refs", fs=m)
+    assert lazy2["data/1"] == ["memory://target", 1, 2]
+    assert lazy2["data/2"] == ["memory://target"]
+    assert lazy2["data/3"] == b"Cdata"
+
+    # the written partitions are readable by either parquet engine
+    pd = pytest.importorskip("pandas")
+    for engine in ["fastparquet", "pyarrow"]:
+        pytest.importorskip(engine)
+        df = pd.read_parquet("memory://refs/data/refs.0.parq", engine=engine)
+        assert list(df.columns) == ["path", "offset", "size", "raw"]
+        assert list(df["path"][1:3]) == ["memory://target"] * 2
+        assert list(df["offset"][1:4]) == [1, 0, 0]
+        assert list(df["size"][1:4]) == [2, 0, 0]
+        assert df["raw"][3] == b"Cdata"
+        assert df["raw"][1] is None
+
+
+def test_deep_parq(m):
+    zarr = pytest.importorskip("zarr")
+    pytest.importorskip("kerchunk")
+    pd = pytest.importorskip("pandas")
+    lz = LazyReferenceMapper.create("memory://refs", fs=m)
+    g = zarr.open_group(lz, mode="w")
+    g2 = g.create_group("instant")
+    g2.create_dataset(name="one", shape=(100,), chunks=(10,), dtype="int64")
+    lz["instant/one/0"] = b"data"
+    lz["instant/one/1"] = ["memory://target", 1, 2]
+    lz.flush()
+
+    lz = LazyReferenceMapper("memory://refs", fs=m)
+    assert lz["instant/one/0"] == b"data"
+    assert lz["instant/one/1"] == ["memory://target", 1, 2]
+
+    # the nested partition is readable by either parquet engine
+    for engine in ["fastparquet", "pyarrow"]:
+        pytest.importorskip(engine)
+        df = pd.read_parquet("memory://refs/instant/one/refs.0.parq", engine=engine)
+        assert df["raw"][0] == b"data"
+        assert df["path"][1] == "memory://target"
+        assert (df["offset"][1], df["size"][1]) == (1, 2)
@@ -1,4 +1,6 @@
+import bisect
 import io
+import random
 import sys
 from pathlib import Path, PurePath
 from unittest.mock import Mock
@@ -436,6 +438,34 @@ def test_merge_offset_ranges(max_gap, max_block):
     assert expect_ends == result_ends
 
 
+@pytest.mark.parametrize("max_gap", [-1, 0, 100])
+def test_merge_offset_ranges_many(max_gap):
+    # many overlapping and nested ranges, compared with a plain interval union
+    rng = random.Random(0)
+    n = 100_000
+    paths = [rng.choice("abc") for _ in range(n)]
+    starts = [rng.randrange(10_000_000) for _ in range(n)]
+    ends = [s + rng.randrange(1, 1000) for s in starts]
+
+    expected = []
+    for p, s, e in sorted(zip(paths, starts, ends)):
+        if expected and expected[-1][0] == p and s - expected[-1][2] <= max_gap:
+            expected[-1][2] = max(expected[-1][2], e)
+        else:
+            expected.append([p, s, e])
+
+    result = merge_offset_ranges(paths, starts, ends, max_gap=max_gap)
+    assert [list(r) for r in zip(*result)] == expected
+
+    # every input range lies within one output block
+    result_paths, result_starts, result_ends = result
+    blocks = list(zip(result_paths, result_starts))
+    for p, s, e in zip(paths, starts, ends):
+        i = bisect.bisect_right(blocks, (p, s)) - 1
+        assert result_paths[i] == p
+        assert result_starts[i] <= s and e <= result_ends[i]
+
+
 def test_size():
     f = io.BytesIO(b"hello")
     assert fsspec.utils.file_size(f) == 5
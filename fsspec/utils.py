@@ -588,10 +588,11 @@ def merge_offset_ranges(
                 new_paths.append(paths[i])
                 new_starts.append(starts[i])
                 new_ends.append(ends[i])
-            else:
+            elif ends[i] is None or ends[i] > new_ends[-1]:
                 # Merge with previous block by updating the
                 # last element of `ends`
                 new_ends[-1] = ends[i]
+            # else: range lies within the previous block already
         return new_paths, new_starts, new_ends
 
     # `paths` is empty. Just return input lists